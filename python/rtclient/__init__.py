@@ -4,6 +4,7 @@
 import asyncio
 import base64
 import uuid
+from collections import deque
 from collections.abc import AsyncGenerator, AsyncIterator, Awaitable, Callable
 from typing import Literal, Optional, TypeGuard, Union
 
@@ -105,9 +106,10 @@ from rtclient.models import (
     UserMessageType,
     Voice,
     create_message_from_dict,
+    create_message_from_json,
 )
 from rtclient.util.id_generator import generate_id
-from rtclient.util.message_queue import MessageQueueWithError
+from rtclient.util.message_queue import KeyPredicate, MessageQueueWithError
 
 
 class RealtimeException(Exception):
@@ -196,16 +198,26 @@ class SharedEndQueue:
         self._receive_delegate = receive_delegate
         self._error_predicate = error_predicate
         self._end_predicate = end_predicate
-        self._queue = []
+        self._queue: deque[ServerMessageType] = deque()
         self._lock = asyncio.Lock()
 
+    def _find_and_remove(self, predicate: Callable[[ServerMessageType], bool]) -> Optional[ServerMessageType]:
+        # Consumers mostly take messages in arrival order, so the match is usually at the head.
+        for i, message in enumerate(self._queue):
+            if predicate(message):
+                if i == 0:
+                    return self._queue.popleft()
+                del self._queue[i]
+                return message
+            elif self._end_predicate(message):
+                return message
+        return None
+
     async def receive(self, predicate: Callable[[ServerMessageType], bool]):
         async with self._lock:
-            for i, message in enumerate(self._queue):
-                if predicate(message):
-                    return self._queue.pop(i)
-                elif self._end_predicate(message):
-                    return message
+            message = self._find_and_remove(predicate)
+            if message is not None:
+                return message
 
             while True:
                 message = await self._receive_delegate()
@@ -315,7 +327,7 @@ class RTTextContent:
         self._part = message.part
         self.__queue = queue
         self.__content_queue = MessageQueueWithError(
-            self._receive_content, lambda m: m.type == "response.content_part.done"
+            self._receive_content, KeyPredicate("type", "response.content_part.done"), key_fields=("type",)
         )
 
     async def _receive_content(self):
@@ -353,7 +365,7 @@ class RTTextContent:
     async def text_chunks(self) -> AsyncGenerator[str]:
         while True:
             message = await self.__content_queue.receive(
-                lambda m: m.type in ["response.text.delta", "response.text.done"]
+                KeyPredicate("type", "response.text.delta", "response.text.done")
             )
             if message is None:
                 break
@@ -584,7 +596,9 @@ class RTClient:
     ):
         self._client = RTLowLevelClient(url, token_credential, key_credential, model, azure_deployment)
 
-        self._message_queue = MessageQueueWithError(self._receive_message, lambda m: m.type == "error")
+        self._message_queue = MessageQueueWithError(
+            self._receive_message, KeyPredicate("type", "error"), key_fields=("type",)
+        )
 
         self.session: Optional[Session] = None
 
@@ -641,7 +655,7 @@ class RTClient:
             session_update_params.max_response_output_tokens = max_response_output_tokens
         await self._client.send(SessionUpdateMessage(session=session_update_params))
 
-        message = await self._message_queue.receive(lambda m: m.type == "session.updated")
+        message = await self._message_queue.receive(KeyPredicate("type", "session.updated"))
         if message.type == "error":
             raise RealtimeException(message.error)
         assert message.type == "session.updated"
@@ -649,12 +663,11 @@ class RTClient:
         return message.session
 
     async def send_audio(self, audio: bytes) -> None:
-        base64_encoded = base64.b64encode(audio).decode("utf-8")
-        await self._client.send(InputAudioBufferAppendMessage(audio=base64_encoded))
+        await self._client.send_audio(audio)
 
     async def commit_audio(self) -> RTInputAudioItem:
         await self._client.send(InputAudioBufferCommitMessage())
-        message = await self._message_queue.receive(lambda m: m.type == "input_audio_buffer.committed")
+        message = await self._message_queue.receive(KeyPredicate("type", "input_audio_buffer.committed"))
         if message.type == "error":
             raise RealtimeException(message.error)
         assert message.type == "input_audio_buffer.committed"
@@ -667,7 +680,7 @@ class RTClient:
 
     async def clear_audio(self) -> None:
         await self._client.send(InputAudioBufferClearMessage())
-        message = await self._message_queue.receive(lambda m: m.type == "input_audio_buffer.cleared")
+        message = await self._message_queue.receive(KeyPredicate("type", "input_audio_buffer.cleared"))
         if message.type == "error":
             raise RealtimeException(message.error)
         assert message.type == "input_audio_buffer.cleared"
@@ -696,7 +709,7 @@ class RTClient:
 
     async def generate_response(self) -> RTResponse:
         await self._client.send(ResponseCreateMessage())
-        message = await self._message_queue.receive(lambda m: m.type == "response.created")
+        message = await self._message_queue.receive(KeyPredicate("type", "response.created"))
         if message.type == "error":
             raise RealtimeException(message.error)
         assert message.type == "response.created"
@@ -708,7 +721,7 @@ class RTClient:
         # TODO: Add the updated quota message as a control type of event.
         while True:
             message = await self._message_queue.receive(
-                lambda m: m.type == "input_audio_buffer.speech_started" or m.type == "response.created"
+                KeyPredicate("type", "input_audio_buffer.speech_started", "response.created")
             )
             if message is None:
                 break
@@ -727,7 +740,7 @@ class RTClient:
 
     async def connect(self):
         await self._client.connect()
-        message = await self._message_queue.receive(lambda m: m.type == "session.created")
+        message = await self._message_queue.receive(KeyPredicate("type", "session.created"))
         if message.type == "error":
             raise RealtimeException(message.error)
         self.session = message.session
@@ -838,4 +851,5 @@ __all__ = [
     "UserMessageType",
     "ServerMessageType",
     "create_message_from_dict",
+    "create_message_from_json",
 ]
@@ -1,21 +1,19 @@
 # Copyright (c) Microsoft Corporation.
 # Licensed under the MIT License.
 
+import asyncio
 import json
 import os
-from collections.abc import AsyncGenerator, AsyncIterator, Callable, Generator
+from collections.abc import AsyncGenerator, AsyncIterator, Callable, Generator, Iterable
 from pathlib import Path
 from typing import Optional
 
-import numpy as np
 import pytest
-import soundfile as sf
 from azure.core.credentials import AzureKeyCredential
 from azure.identity.aio import DefaultAzureCredential
 from dotenv import load_dotenv
-from scipy.signal import resample
 
-from rtclient import RealtimeException, RTClient, RTInputAudioItem, RTResponse
+from rtclient import RealtimeException, RTClient, RTInputAudioItem, RTLowLevelClient, RTResponse
 from rtclient.models import InputAudioTranscription, InputTextContentPart, NoTurnDetection, ServerVAD, UserMessageItem
 
 load_dotenv()
@@ -38,7 +36,7 @@ def should_run_azure_openai_live_tests():
 
 
 if not run_live_tests:
-    pytest.skip("Skipping live tests")
+    pytest.skip("Skipping live tests", allow_module_level=True)
 
 
 @pytest.fixture
@@ -47,27 +45,34 @@ def test_data_dir() -> str:
 
 
 def resample_audio(audio_data, original_sample_rate, target_sample_rate):
-    number_of_samples = round(len(audio_data) * float(target_sample_rate) / original_sample_rate)
-    resampled_audio = resample(audio_data, number_of_samples)
-    return resampled_audio.astype(np.int16)
+    if original_sample_rate == target_sample_rate:
+        return audio_data
+    # Imported lazily so tests that don't use audio don't pay for it at collection time.
+    import soxr
+
+    # soxr works on int16 directly, so there is no float round trip.
+    return soxr.resample(audio_data, original_sample_rate, target_sample_rate)
 
 
 class AudioSamples:
     def __init__(self, audio_file: str, sample_rate: int = 24000):
+        import soundfile as sf
+
         self._sample_rate = sample_rate
         audio_data, original_sample_rate = sf.read(audio_file, dtype="int16")
-
-        if original_sample_rate != sample_rate:
-            audio_data = resample_audio(audio_data, original_sample_rate, sample_rate)
-        self._audio_bytes = audio_data.tobytes()
+        audio_data = resample_audio(audio_data, original_sample_rate, sample_rate)
+        # Keep the int16 samples as they are and only copy out bytes one chunk at a time.
+        self._audio = audio_data
 
     def chunks(self):
         duration_ms = 100
-        samples_per_chunk = self._sample_rate * (duration_ms / 1000)
-        bytes_per_sample = 2
-        bytes_per_chunk = int(samples_per_chunk * bytes_per_sample)
-        for i in range(0, len(self._audio_bytes), bytes_per_chunk):
-            yield self._audio_bytes[i : i + bytes_per_chunk]
+        samples_per_chunk = self._sample_rate * duration_ms // 1000
+        full_chunks, remainder = divmod(len(self._audio), samples_per_chunk)
+        split = full_chunks * samples_per_chunk
+        for row in self._audio[:split].reshape(full_chunks, samples_per_chunk):
+            yield row.tobytes()
+        if remainder:
+            yield self._audio[split:].tobytes()
 
 
 @pytest.fixture
@@ -85,6 +90,12 @@ def audio_files(test_data_dir: str) -> Callable[[str], AsyncIterator[str]]:
     return get_audio_file
 
 
+async def send_audio_chunks(client: RTClient, chunks: Iterable[bytes]):
+    # Sends are serialized (in order) by the client, so we can queue them all at once
+    # instead of waiting for each write to complete before encoding the next chunk.
+    await asyncio.gather(*(client.send_audio(chunk) for chunk in chunks))
+
+
 @pytest.fixture(params=["openai", "azure_openai"])
 async def client(request: pytest.FixtureRequest) -> AsyncGenerator[RTClient, None]:
     if request.param == "openai" and should_run_openai_live_tests():
@@ -105,6 +116,7 @@ async def client(request: pytest.FixtureRequest) -> AsyncGenerator[RTClient, Non
             yield client
     else:
         pytest.skip(f"Skipping {request.param} live tests")
+    await RTLowLevelClient.close_shared_connector()
 
 
 @pytest.mark.asyncio
@@ -118,8 +130,7 @@ async def test_configure(client: RTClient):
 @pytest.mark.asyncio
 async def test_commit_audio(client: RTClient, audio_samples: Generator[bytes]):
     await client.configure(turn_detection=NoTurnDetection())
-    for chunk in audio_samples:
-        await client.send_audio(chunk)
+    await send_audio_chunks(client, audio_samples)
     item = await client.commit_audio()
     await item
 
@@ -129,8 +140,7 @@ async def test_commit_audio_with_transcription(client: RTClient, audio_samples:
     await client.configure(
         turn_detection=NoTurnDetection(), input_audio_transcription=InputAudioTranscription(model="whisper-1")
     )
-    for chunk in audio_samples:
-        await client.send_audio(chunk)
+    await send_audio_chunks(client, audio_samples)
     item = await client.commit_audio()
     assert item is not None
     await item
@@ -141,8 +151,7 @@ async def test_commit_audio_with_transcription(client: RTClient, audio_samples:
 @pytest.mark.asyncio
 async def test_clear_audio(client: RTClient, audio_samples: Generator[bytes]):
     await client.configure(turn_detection=NoTurnDetection())
-    for chunk in audio_samples:
-        await client.send_audio(chunk)
+    await send_audio_chunks(client, audio_samples)
     await client.clear_audio()
 
     with pytest.raises(RealtimeException) as ex:
@@ -372,8 +381,7 @@ async def test_items_audio_in_text_out(client: RTClient, audio_files: Callable[[
         input_audio_transcription=InputAudioTranscription(model="whisper-1"),
         turn_detection=NoTurnDetection(),
     )
-    for chunk in audio_file:
-        await client.send_audio(chunk)
+    await send_audio_chunks(client, audio_file)
     await client.commit_audio()
     response = await client.generate_response()
 
@@ -396,8 +404,7 @@ async def test_items_audio_in_text_out_with_vad(client: RTClient, audio_files: C
         input_audio_transcription=InputAudioTranscription(model="whisper-1"),
         turn_detection=ServerVAD(),
     )
-    for chunk in audio_samples:
-        await client.send_audio(chunk)
+    await send_audio_chunks(client, audio_samples)
     input_item: Optional[RTInputAudioItem] = None
     response: Optional[RTResponse] = None
     for _ in [1, 2]:
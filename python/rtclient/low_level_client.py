@@ -1,17 +1,34 @@
 # Copyright (c) Microsoft Corporation.
 # Licensed under the MIT License.
 
-import json
+import asyncio
+import base64
+import inspect
 import os
+import time
 import uuid
+import weakref
 from collections.abc import AsyncIterator
 from typing import Optional
 
-from aiohttp import ClientSession, WSMsgType, WSServerHandshakeError
-from azure.core.credentials import AzureKeyCredential
+from aiohttp import (
+    ClientSession,
+    ClientWebSocketResponse,
+    ClientWSTimeout,
+    TCPConnector,
+    WSMsgType,
+    WSServerHandshakeError,
+)
+from azure.core.credentials import AccessToken, AzureKeyCredential
 from azure.core.credentials_async import AsyncTokenCredential
-
-from rtclient.models import ServerMessageType, UserMessageType, create_message_from_dict
+from multidict import CIMultiDict
+
+from rtclient.models import (
+    InputAudioBufferAppendMessage,
+    ServerMessageType,
+    UserMessageType,
+    create_message_from_json,
+)
 from rtclient.util.user_agent import get_user_agent
 
 
@@ -23,6 +40,34 @@ class ConnectionError(Exception):
     pass
 
 
+_TOKEN_REFRESH_MARGIN_SECONDS = 60
+
+# Audio payloads are base64 PCM that doesn't deflate well, so permessage-deflate is kept off.
+# The heartbeat detects dead connections during the long idle stretches between turns.
+# Closing waits at most a second for the server's close frame instead of aiohttp's default of ten.
+_WS_CONNECT_OPTIONS = {
+    "compress": 0,
+    "heartbeat": 20.0,
+    "timeout": ClientWSTimeout(ws_receive=None, ws_close=1.0),
+}
+# Since aiohttp 3.14, text frames can be handed over as raw UTF-8 bytes, which orjson parses without
+# decoding them to str first. Older versions deliver str, which orjson accepts just as well.
+if "decode_text" in inspect.signature(ClientSession.ws_connect).parameters:
+    _WS_CONNECT_OPTIONS["decode_text"] = False
+
+# Connectors are bound to the event loop they were created on, so we keep one per loop.
+_shared_connectors: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, TCPConnector]" = weakref.WeakKeyDictionary()
+
+
+def _get_shared_connector() -> TCPConnector:
+    loop = asyncio.get_running_loop()
+    connector = _shared_connectors.get(loop)
+    if connector is None or connector.closed:
+        connector = TCPConnector(limit=0, ttl_dns_cache=300)
+        _shared_connectors[loop] = connector
+    return connector
+
+
 class RTLowLevelClient:
     def __init__(
         self,
@@ -47,16 +92,26 @@ class RTLowLevelClient:
         self._url = url if self._is_azure_openai else "wss://api.openai.com"
         self._token_credential = token_credential
         self._key_credential = key_credential
-        self._session = ClientSession(base_url=self._url)
+        self._session: Optional[ClientSession] = None
+        self.ws: Optional[ClientWebSocketResponse] = None
         self._model = model
         self._azure_deployment = azure_deployment
+        self._serialization_context = {"is_azure": self._is_azure_openai}
+        self._send_lock = asyncio.Lock()
         self.request_id: Optional[uuid.UUID] = None
+        self._token: Optional[AccessToken] = None
+        # Built once as the multidict aiohttp uses internally, so each connect only copies it.
+        self._static_headers: CIMultiDict[str] = CIMultiDict({"User-Agent": get_user_agent()})
+        if not self._is_azure_openai:
+            self._static_headers["openai-beta"] = "realtime=v1"
 
     async def _get_auth(self):
         if self._token_credential:
-            scope = "https://cognitiveservices.azure.com/.default"
-            token = await self._token_credential.get_token(scope)
-            return {"Authorization": f"Bearer {token.token}"}
+            # Reuse the last token until it is about to expire, so reconnects don't hit the credential.
+            if self._token is None or self._token.expires_on - time.time() < _TOKEN_REFRESH_MARGIN_SECONDS:
+                scope = "https://cognitiveservices.azure.com/.default"
+                self._token = await self._token_credential.get_token(scope)
+            return {"Authorization": f"Bearer {self._token.token}"}
         elif self._key_credential:
             return {"api-key": self._key_credential.key}
         else:
@@ -71,47 +126,73 @@ class RTLowLevelClient:
             "/openai/realtime" if path is None else path,
         )
 
+    @staticmethod
+    async def close_shared_connector():
+        """
+        Close the connector shared by all clients running on the current event loop.
+        Call this once the application is done creating clients.
+        """
+        connector = _shared_connectors.pop(asyncio.get_running_loop(), None)
+        if connector is not None:
+            await connector.close()
+
     async def connect(self):
+        if self._session is None or self._session.closed:
+            self._session = ClientSession(base_url=self._url, connector=_get_shared_connector(), connector_owner=False)
         try:
             self.request_id = uuid.uuid4()
             if self._is_azure_openai:
                 api_version, path = RTLowLevelClient._get_azure_params()
-                auth_headers = await self._get_auth()
-                headers = {
-                    "x-ms-client-request-id": str(self.request_id),
-                    "User-Agent": get_user_agent(),
-                    **auth_headers,
-                }
+                headers = self._static_headers.copy()
+                headers["x-ms-client-request-id"] = str(self.request_id)
+                headers.update(await self._get_auth())
                 self.ws = await self._session.ws_connect(
                     path,
                     headers=headers,
                     params={"deployment": self._azure_deployment, "api-version": api_version},
+                    **_WS_CONNECT_OPTIONS,
                 )
             else:
-                headers = {
-                    "Authorization": f"Bearer {self._key_credential.key}",
-                    "openai-beta": "realtime=v1",
-                    "User-Agent": get_user_agent(),
-                }
-                self.ws = await self._session.ws_connect("/v1/realtime", headers=headers, params={"model": self._model})
+                headers = self._static_headers.copy()
+                headers["Authorization"] = f"Bearer {self._key_credential.key}"
+                self.ws = await self._session.ws_connect(
+                    "/v1/realtime", headers=headers, params={"model": self._model}, **_WS_CONNECT_OPTIONS
+                )
         except WSServerHandshakeError as e:
             await self._session.close()
             error_message = f"Received status code {e.status} from the server"
             raise ConnectionError(error_message, e.headers) from e
 
     async def send(self, message: UserMessageType):
-        message._is_azure = self._is_azure_openai
-        message_json = message.model_dump_json(exclude_unset=True)
-        await self.ws.send_str(message_json)
+        # Serialize straight to UTF-8 bytes and send them as a text frame, so aiohttp
+        # doesn't have to encode the str again before framing.
+        if isinstance(message, InputAudioBufferAppendMessage):
+            # Audio appends are by far the most frequent outbound message, so they skip pydantic.
+            payload = InputAudioBufferAppendMessage.fast_serialize(
+                message.audio, message.event_id, event_id_set="event_id" in message.model_fields_set
+            )
+        else:
+            payload = message.__pydantic_serializer__.to_json(
+                message, exclude_unset=True, context=self._serialization_context
+            )
+        async with self._send_lock:
+            await self.ws.send_frame(payload, WSMsgType.TEXT)
+
+    async def send_audio(self, audio: bytes):
+        """
+        Append raw PCM audio to the input audio buffer.
+        Equivalent to sending an InputAudioBufferAppendMessage, without building the message model.
+        """
+        payload = InputAudioBufferAppendMessage.fast_serialize(base64.b64encode(audio))
+        async with self._send_lock:
+            await self.ws.send_frame(payload, WSMsgType.TEXT)
 
     async def recv(self) -> ServerMessageType | None:
         if self.ws.closed:
             return None
         websocket_message = await self.ws.receive()
         if websocket_message.type == WSMsgType.TEXT:
-            data = json.loads(websocket_message.data)
-            msg = create_message_from_dict(data)
-            return msg
+            return create_message_from_json(websocket_message.data)
         else:
             return None
 
@@ -125,12 +206,15 @@ class RTLowLevelClient:
         return message
 
     async def close(self):
-        await self.ws.close()
-        await self._session.close()
+        if self.ws is not None and not self.ws.closed:
+            await self.ws.close()
+        if self._session is not None:
+            # Only the session is closed here, the connector is shared with other clients.
+            await self._session.close()
 
     @property
     def closed(self) -> bool:
-        return self.ws.closed
+        return self.ws is None or self.ws.closed
 
     async def __aenter__(self):
         await self.connect()
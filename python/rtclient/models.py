@@ -1,19 +1,26 @@
 # Copyright (c) Microsoft Corporation.
 # Licensed under the MIT License.
 
+import logging
 from typing import Annotated, Any, Literal, Optional, Union
 
+import orjson
 from pydantic import (
     AliasChoices,
     BaseModel,
+    ConfigDict,
     Field,
     SerializationInfo,
     SerializerFunctionWrapHandler,
+    TypeAdapter,
+    ValidationError,
     model_serializer,
 )
 
 from rtclient.util.model_helpers import ModelWithDefaults
 
+logger = logging.getLogger(__name__)
+
 Voice = Literal["alloy", "ash", "ballad", "coral", "echo", "sage", "shimmer", "verse"]
 AudioFormat = Literal["pcm16", "g711-ulaw", "g711-alaw"]
 Modality = Literal["text", "audio"]
@@ -24,6 +31,8 @@ class NoTurnDetection(ModelWithDefaults):
 
 
 class ServerVAD(ModelWithDefaults):
+    model_config = ConfigDict(frozen=True)
+
     type: Literal["server_vad"] = "server_vad"
     threshold: Optional[Annotated[float, Field(strict=True, ge=0.0, le=1.0)]] = None
     prefix_padding_ms: Optional[int] = None
@@ -48,7 +57,6 @@ class InputAudioTranscription(BaseModel):
 
 
 class ClientMessageBase(ModelWithDefaults):
-    _is_azure: bool = False
     event_id: Optional[str] = None
 
 
@@ -84,7 +92,8 @@ class SessionUpdateMessage(ClientMessageBase):
     @model_serializer(mode="wrap")
     def _azure_compatibility(self, next: SerializerFunctionWrapHandler, info: SerializationInfo):
         serialized = next(self)
-        if not self._is_azure:
+        is_azure = info.context is not None and info.context.get("is_azure", False)
+        if not is_azure:
             if (
                 self.session is not None
                 and self.session.turn_detection is not None
@@ -104,6 +113,25 @@ class InputAudioBufferAppendMessage(ClientMessageBase):
     type: Literal["input_audio_buffer.append"] = "input_audio_buffer.append"
     audio: str
 
+    @classmethod
+    def fast_serialize(
+        cls, audio: Union[str, bytes], event_id: Optional[str] = None, *, event_id_set: Optional[bool] = None
+    ) -> bytes:
+        """
+        Serialize an append message without building the model, producing the same JSON as
+        model_dump_json(exclude_unset=True). `audio` is the base64-encoded audio, either as str or
+        as the bytes returned by base64.b64encode, which are used as is. `event_id_set` tells whether
+        event_id was explicitly set, so that an explicit None is kept as null; it defaults to
+        `event_id is not None`.
+        """
+        audio_json = b'"' + audio + b'"' if isinstance(audio, bytes) else orjson.dumps(audio)
+        if event_id_set is None:
+            event_id_set = event_id is not None
+        if not event_id_set:
+            return b'{"type":"input_audio_buffer.append","audio":' + audio_json + b"}"
+        event_id_json = orjson.dumps(event_id)
+        return b'{"event_id":' + event_id_json + b',"type":"input_audio_buffer.append","audio":' + audio_json + b"}"
+
 
 class InputAudioBufferCommitMessage(ClientMessageBase):
     """
@@ -673,65 +701,61 @@ ServerMessageType = Annotated[
 ]
 
 
+_SERVER_MESSAGE_TYPES: dict[str, type[ServerMessageBase]] = {
+    "error": ErrorMessage,
+    "session.created": SessionCreatedMessage,
+    "session.updated": SessionUpdatedMessage,
+    "input_audio_buffer.committed": InputAudioBufferCommittedMessage,
+    "input_audio_buffer.cleared": InputAudioBufferClearedMessage,
+    "input_audio_buffer.speech_started": InputAudioBufferSpeechStartedMessage,
+    "input_audio_buffer.speech_stopped": InputAudioBufferSpeechStoppedMessage,
+    "conversation.item.created": ItemCreatedMessage,
+    "conversation.item.truncated": ItemTruncatedMessage,
+    "conversation.item.deleted": ItemDeletedMessage,
+    "conversation.item.input_audio_transcription.delta": ItemInputAudioTranscriptionDeltaMessage,
+    "conversation.item.input_audio_transcription.completed": ItemInputAudioTranscriptionCompletedMessage,
+    "conversation.item.input_audio_transcription.failed": ItemInputAudioTranscriptionFailedMessage,
+    "response.created": ResponseCreatedMessage,
+    "response.done": ResponseDoneMessage,
+    "response.output_item.added": ResponseOutputItemAddedMessage,
+    "response.output_item.done": ResponseOutputItemDoneMessage,
+    "response.content_part.added": ResponseContentPartAddedMessage,
+    "response.content_part.done": ResponseContentPartDoneMessage,
+    "response.text.delta": ResponseTextDeltaMessage,
+    "response.text.done": ResponseTextDoneMessage,
+    "response.audio_transcript.delta": ResponseAudioTranscriptDeltaMessage,
+    "response.audio_transcript.done": ResponseAudioTranscriptDoneMessage,
+    "response.audio.delta": ResponseAudioDeltaMessage,
+    "response.audio.done": ResponseAudioDoneMessage,
+    "response.function_call_arguments.delta": ResponseFunctionCallArgumentsDeltaMessage,
+    "response.function_call_arguments.done": ResponseFunctionCallArgumentsDoneMessage,
+    "rate_limits.updated": RateLimitsUpdatedMessage,
+}
+
+
 def create_message_from_dict(data: dict) -> ServerMessageType:
     event_type = data.get("type")
-    match event_type:
-        case "error":
-            return ErrorMessage(**data)
-        case "session.created":
-            return SessionCreatedMessage(**data)
-        case "session.updated":
-            return SessionUpdatedMessage(**data)
-        case "input_audio_buffer.committed":
-            return InputAudioBufferCommittedMessage(**data)
-        case "input_audio_buffer.cleared":
-            return InputAudioBufferClearedMessage(**data)
-        case "input_audio_buffer.speech_started":
-            return InputAudioBufferSpeechStartedMessage(**data)
-        case "input_audio_buffer.speech_stopped":
-            return InputAudioBufferSpeechStoppedMessage(**data)
-        case "conversation.item.created":
-            return ItemCreatedMessage(**data)
-        case "conversation.item.truncated":
-            return ItemTruncatedMessage(**data)
-        case "conversation.item.deleted":
-            return ItemDeletedMessage(**data)
-        case "conversation.item.input_audio_transcription.delta":
-            return ItemInputAudioTranscriptionDeltaMessage(**data)
-        case "conversation.item.input_audio_transcription.completed":
-            return ItemInputAudioTranscriptionCompletedMessage(**data)
-        case "conversation.item.input_audio_transcription.failed":
-            return ItemInputAudioTranscriptionFailedMessage(**data)
-        case "response.created":
-            return ResponseCreatedMessage(**data)
-        case "response.done":
-            return ResponseDoneMessage(**data)
-        case "response.output_item.added":
-            return ResponseOutputItemAddedMessage(**data)
-        case "response.output_item.done":
-            return ResponseOutputItemDoneMessage(**data)
-        case "response.content_part.added":
-            return ResponseContentPartAddedMessage(**data)
-        case "response.content_part.done":
-            return ResponseContentPartDoneMessage(**data)
-        case "response.text.delta":
-            return ResponseTextDeltaMessage(**data)
-        case "response.text.done":
-            return ResponseTextDoneMessage(**data)
-        case "response.audio_transcript.delta":
-            return ResponseAudioTranscriptDeltaMessage(**data)
-        case "response.audio_transcript.done":
-            return ResponseAudioTranscriptDoneMessage(**data)
-        case "response.audio.delta":
-            return ResponseAudioDeltaMessage(**data)
-        case "response.audio.done":
-            return ResponseAudioDoneMessage(**data)
-        case "response.function_call_arguments.delta":
-            return ResponseFunctionCallArgumentsDeltaMessage(**data)
-        case "response.function_call_arguments.done":
-            return ResponseFunctionCallArgumentsDoneMessage(**data)
-        case "rate_limits.updated":
-            return RateLimitsUpdatedMessage(**data)
-        case _:
-            print(f"Unknown message type: {event_type}, data: {data}")
-            return UnknownMessage(**data)
+    message_type = _SERVER_MESSAGE_TYPES.get(event_type)
+    if message_type is None:
+        logger.warning("Unknown message type: %s, data: %s", event_type, data)
+        return UnknownMessage.model_validate(data)
+    return message_type.model_validate(data)
+
+
+# pydantic parses small frames faster itself, orjson plus validating the dict wins on large ones
+# such as audio deltas.
+_SMALL_FRAME_SIZE = 1024
+
+_known_server_message_adapter = TypeAdapter(
+    Annotated[Union[tuple(_SERVER_MESSAGE_TYPES.values())], Field(discriminator="type")]
+)
+
+
+def create_message_from_json(data: str | bytes) -> ServerMessageType:
+    if len(data) < _SMALL_FRAME_SIZE:
+        try:
+            return _known_server_message_adapter.validate_json(data)
+        except ValidationError:
+            # Unknown types fall through to the dict path, which also reports invalid frames.
+            pass
+    return create_message_from_dict(orjson.loads(data))
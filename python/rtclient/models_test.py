@@ -0,0 +1,58 @@
+# Copyright (c) Microsoft Corporation.
+# Licensed under the MIT License.
+
+import base64
+import json
+
+from rtclient.models import InputAudioBufferAppendMessage, create_message_from_dict, create_message_from_json
+
+
+def test_fast_serialize_audio_append_matches_model_dump():
+    messages = [
+        InputAudioBufferAppendMessage(audio="AAECAwQF"),
+        InputAudioBufferAppendMessage(audio="AAECAwQF", event_id='event-"1"'),
+        InputAudioBufferAppendMessage(audio="AAECAwQF", event_id=None),
+        InputAudioBufferAppendMessage(audio='not "base64"\n'),
+    ]
+    for message in messages:
+        fast = InputAudioBufferAppendMessage.fast_serialize(
+            message.audio, message.event_id, event_id_set="event_id" in message.model_fields_set
+        )
+        assert fast == message.model_dump_json(exclude_unset=True).encode("utf-8")
+
+
+def test_fast_serialize_audio_append_from_bytes():
+    audio = base64.b64encode(bytes(range(256)))
+    message = InputAudioBufferAppendMessage(audio=audio.decode("utf-8"))
+    fast = json.loads(InputAudioBufferAppendMessage.fast_serialize(audio))
+    expected = json.loads(message.model_dump_json(exclude_unset=True))
+    assert fast == expected
+
+
+def test_create_message_from_json_matches_dict_path():
+    frames = [
+        {
+            "type": "response.text.delta",
+            "event_id": "e1",
+            "response_id": "r",
+            "item_id": "i",
+            "output_index": 0,
+            "content_index": 0,
+            "delta": "Hello",
+        },
+        {
+            "type": "response.audio.delta",
+            "event_id": "e2",
+            "response_id": "r",
+            "item_id": "i",
+            "output_index": 0,
+            "content_index": 0,
+            "delta": base64.b64encode(bytes(4800)).decode("utf-8"),
+        },
+        {"type": "some.future.event", "event_id": "e3"},
+    ]
+    for frame in frames:
+        expected = create_message_from_dict(frame)
+        message = create_message_from_json(json.dumps(frame))
+        assert type(message) is type(expected)
+        assert message == expected
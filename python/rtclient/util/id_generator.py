@@ -3,7 +3,11 @@
 
 import secrets
 
+_ID_LENGTH = 32
+
 
 def generate_id(prefix: str) -> str:
-    suffix = secrets.token_urlsafe(24)
-    return f"{prefix}-{suffix[len(prefix) + 1:]}"
+    suffix_length = max(_ID_LENGTH - len(prefix) - 1, 0)
+    # Every 3 random bytes become 4 url-safe characters, so only draw as many bytes as the suffix needs.
+    suffix = secrets.token_urlsafe((suffix_length * 3 + 3) // 4)
+    return f"{prefix}-{suffix[:suffix_length]}"
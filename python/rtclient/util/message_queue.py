@@ -2,28 +2,177 @@
 # Licensed under the MIT license.
 
 import asyncio
-from collections.abc import Awaitable, Callable
-from typing import Generic, Optional, TypeVar
+import itertools
+from collections import deque
+from collections.abc import Awaitable, Callable, Hashable, Iterable
+from typing import Any, Generic, Optional, TypeVar
 
 T = TypeVar("T")
 
+_MISSING = object()
+
+# Buffered messages are handed over without suspending, so the poll loop yields to the
+# event loop every this many messages to keep other tasks responsive during bursts.
+_YIELD_EVERY = 32
+
+
+class KeyPredicate:
+    """
+    A predicate that matches messages whose `field` attribute equals one of `values`.
+
+    Behaves like any other predicate, but lets a MessageQueue indexed on `field` find
+    stored messages by key instead of scanning all of them.
+    """
+
+    def __init__(self, field: str, *values: Hashable):
+        self.field = field
+        self.values = frozenset(values)
+
+    def __call__(self, message: Any) -> bool:
+        return getattr(message, self.field, _MISSING) in self.values
+
+    def __eq__(self, other: object) -> bool:
+        if not isinstance(other, KeyPredicate):
+            return NotImplemented
+        return self.field == other.field and self.values == other.values
+
+    def __hash__(self) -> int:
+        return hash((self.field, self.values))
+
+    def __or__(self, other: "KeyPredicate") -> "KeyPredicate":
+        if not isinstance(other, KeyPredicate) or other.field != self.field:
+            return NotImplemented
+        return KeyPredicate(self.field, *self.values, *other.values)
+
+
+_Receiver = tuple[int, Callable[[Any], bool], asyncio.Future]
+
 
 class MessageQueue(Generic[T]):
-    def __init__(self, receive_delegate: Callable[[], Awaitable[T]]):
-        self._stored_messages: list[T] = []
-        self.waiting_receivers: list[tuple[Callable[[T], bool], asyncio.Future]] = []
+    def __init__(self, receive_delegate: Callable[[], Awaitable[T]], key_fields: Iterable[str] = ()):
+        # Stored messages are kept in arrival order, keyed by a sequence number, with an index from
+        # (field, value) to the sequence numbers of the messages carrying it.
+        self._stored_messages: dict[int, T] = {}
+        self._stored_index: dict[tuple[str, Hashable], deque[int]] = {}
+        self._sequence = itertools.count()
+        self._key_fields = tuple(key_fields)
+        # Receivers waiting on a KeyPredicate are indexed by field and value, everything else is kept
+        # in a plain list. Each receiver carries a sequence number so that a message still goes to the
+        # earliest registered receiver that accepts it, whichever of the two it is in.
+        self._receiver_sequence = itertools.count()
+        self._keyed_receivers: dict[str, dict[Hashable, deque[_Receiver]]] = {}
+        self._generic_receivers: deque[_Receiver] = deque()
+        self._receivers_count = 0
         self.is_polling: bool = False
         self.receive_delegate = receive_delegate
         self.poll_task: Optional[asyncio.Task] = None
 
     def _push_back(self, message: T):
-        self._stored_messages.append(message)
+        sequence = next(self._sequence)
+        self._stored_messages[sequence] = message
+        for field in self._key_fields:
+            value = getattr(message, field, _MISSING)
+            if value is not _MISSING:
+                self._stored_index.setdefault((field, value), deque()).append(sequence)
+
+    def _remove_stored(self, sequence: int) -> T:
+        message = self._stored_messages.pop(sequence)
+        for field in self._key_fields:
+            value = getattr(message, field, _MISSING)
+            if value is _MISSING:
+                continue
+            key = (field, value)
+            bucket = self._stored_index[key]
+            if bucket[0] == sequence:
+                bucket.popleft()
+            else:
+                bucket.remove(sequence)
+            if not bucket:
+                del self._stored_index[key]
+        return message
 
     def _find_and_remove(self, predicate: Callable[[T], bool]) -> Optional[T]:
-        for i, message in enumerate(self._stored_messages):
-            if predicate(message):
-                return self._stored_messages.pop(i)
-        return None
+        if isinstance(predicate, KeyPredicate) and predicate.field in self._key_fields:
+            heads = (self._stored_index.get((predicate.field, value)) for value in predicate.values)
+            sequence = min((bucket[0] for bucket in heads if bucket), default=None)
+        else:
+            sequence = next((seq for seq, message in self._stored_messages.items() if predicate(message)), None)
+        if sequence is None:
+            return None
+        return self._remove_stored(sequence)
+
+    def _add_receiver(self, predicate: Callable[[T], bool], future: asyncio.Future):
+        receiver = (next(self._receiver_sequence), predicate, future)
+        if isinstance(predicate, KeyPredicate):
+            by_value = self._keyed_receivers.setdefault(predicate.field, {})
+            for value in predicate.values:
+                by_value.setdefault(value, deque()).append(receiver)
+        else:
+            self._generic_receivers.append(receiver)
+        self._receivers_count += 1
+
+    def _remove_receiver(self, receiver: _Receiver):
+        predicate = receiver[1]
+        if isinstance(predicate, KeyPredicate):
+            by_value = self._keyed_receivers[predicate.field]
+            for value in predicate.values:
+                bucket = by_value[value]
+                if bucket[0] is receiver:
+                    bucket.popleft()
+                else:
+                    bucket.remove(receiver)
+                if not bucket:
+                    del by_value[value]
+            if not by_value:
+                del self._keyed_receivers[predicate.field]
+        elif self._generic_receivers[0] is receiver:
+            self._generic_receivers.popleft()
+        else:
+            self._generic_receivers.remove(receiver)
+        self._receivers_count -= 1
+
+    def _find_receiver(self, message: T) -> Optional[_Receiver]:
+        found: Optional[_Receiver] = None
+        for field, by_value in self._keyed_receivers.items():
+            value = getattr(message, field, _MISSING)
+            if value is _MISSING or not isinstance(value, Hashable):
+                continue
+            bucket = by_value.get(value)
+            if bucket and (found is None or bucket[0][0] < found[0]):
+                found = bucket[0]
+        for receiver in self._generic_receivers:
+            if found is not None and receiver[0] > found[0]:
+                break
+            if receiver[1](message):
+                return receiver
+        return found
+
+    def _ordered_receivers(self) -> list[_Receiver]:
+        # A keyed receiver sits in one bucket per value it accepts, so it is deduplicated by sequence.
+        receivers = {receiver[0]: receiver for receiver in self._generic_receivers}
+        for by_value in self._keyed_receivers.values():
+            for bucket in by_value.values():
+                receivers.update((receiver[0], receiver) for receiver in bucket)
+        return [receivers[sequence] for sequence in sorted(receivers)]
+
+    def _take_receivers(self) -> list[asyncio.Future]:
+        futures = [future for _, _, future in self._ordered_receivers()]
+        self._generic_receivers.clear()
+        self._keyed_receivers.clear()
+        self._receivers_count = 0
+        return futures
+
+    @property
+    def waiting_receivers(self) -> list[tuple[Callable[[T], bool], asyncio.Future]]:
+        """
+        The waiting (predicate, future) pairs in the order they were registered.
+        Kept for compatibility; this is a snapshot, so changing the list does not affect the queue.
+        Prefer waiting_receivers_count() when only the number is needed.
+        """
+        return [(predicate, future) for _, predicate, future in self._ordered_receivers()]
+
+    def waiting_receivers_count(self) -> int:
+        return self._receivers_count
 
     async def _poll_receive(self):
         if self.is_polling:
@@ -31,14 +180,18 @@ class MessageQueue(Generic[T]):
 
         try:
             self.is_polling = True
+            received = 0
             while self.is_polling:
                 message = await self.receive_delegate()
                 if message is None:
                     self._notify_end_of_stream()
                     break
                 self._notify_receiver(message)
-                if len(self.waiting_receivers) == 0:
+                if self._receivers_count == 0:
                     break
+                received += 1
+                if received % _YIELD_EVERY == 0:
+                    await asyncio.sleep(0)
         except Exception as error:
             self._notify_exception(error)
         finally:
@@ -46,21 +199,21 @@ class MessageQueue(Generic[T]):
             self.poll_task = None
 
     def _notify_exception(self, error: Exception):
-        for _, future in self.waiting_receivers:
+        for future in self._take_receivers():
             if not future.done():
                 future.set_exception(error)
-        self.waiting_receivers.clear()
 
     def _notify_end_of_stream(self):
-        for _, future in self.waiting_receivers:
+        for future in self._take_receivers():
             if not future.done():
                 future.set_result(None)
-        self.waiting_receivers.clear()
 
     def _notify_receiver(self, message: T):
-        for i, (predicate, future) in enumerate(self.waiting_receivers):
-            if predicate(message):
-                del self.waiting_receivers[i]
+        while (receiver := self._find_receiver(message)) is not None:
+            self._remove_receiver(receiver)
+            future = receiver[2]
+            # Receivers that were cancelled while waiting are dropped and the next one is tried.
+            if not future.done():
                 future.set_result(message)
                 return
         self._push_back(message)
@@ -73,8 +226,8 @@ class MessageQueue(Generic[T]):
         if found_message is not None:
             return found_message
 
-        future = asyncio.Future()
-        self.waiting_receivers.append((predicate, future))
+        future = asyncio.get_running_loop().create_future()
+        self._add_receiver(predicate, future)
 
         if not self.is_polling and self.poll_task is None:
             self.poll_task = asyncio.create_task(self._poll_receive())
@@ -83,21 +236,41 @@ class MessageQueue(Generic[T]):
 
 
 class MessageQueueWithError(MessageQueue[T]):
-    def __init__(self, receive_delegate: Callable[[], Awaitable[T]], error_predicate: Callable[[T], bool]):
-        super().__init__(receive_delegate)
+    def __init__(
+        self,
+        receive_delegate: Callable[[], Awaitable[T]],
+        error_predicate: Callable[[T], bool],
+        key_fields: Iterable[str] = (),
+    ):
+        super().__init__(receive_delegate, key_fields)
         self._error_predicate = error_predicate
         self._error: Optional[T] = None
+        # Callers build the same few key predicates over and over, so their merges with the
+        # error predicate are kept instead of being rebuilt on every receive.
+        self._merged_predicates: dict[KeyPredicate, KeyPredicate] = {}
+
+    def _or_error(self, predicate: Callable[[T], bool]) -> Callable[[T], bool]:
+        error_predicate = self._error_predicate
+        if (
+            isinstance(predicate, KeyPredicate)
+            and isinstance(error_predicate, KeyPredicate)
+            and predicate.field == error_predicate.field
+        ):
+            merged = self._merged_predicates.get(predicate)
+            if merged is None:
+                merged = self._merged_predicates[predicate] = predicate | error_predicate
+            return merged
+        return lambda m: predicate(m) or error_predicate(m)
 
     def _notify_error(self, error: T):
-        for _, future in self.waiting_receivers:
+        for future in self._take_receivers():
             if not future.done():
                 future.set_result(error)
-        self.waiting_receivers.clear()
 
     async def receive(self, predicate) -> Optional[T]:
         if self._error is not None:
             return self._error
-        message = await super().receive(lambda m: predicate(m) or self._error_predicate(m))
+        message = await super().receive(self._or_error(predicate))
         if message is not None and self._error_predicate(message):
             self._error = message
             self._notify_error(message)
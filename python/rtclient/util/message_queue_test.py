@@ -4,7 +4,7 @@
 import asyncio
 
 import pytest
-from message_queue import MessageQueue
+from message_queue import KeyPredicate, MessageQueue, MessageQueueWithError
 
 
 class Message:
@@ -198,3 +198,103 @@ async def test_receive_with_always_false_predicate(message_queue):
     result = await asyncio.wait_for(message_queue.receive(lambda m: False), timeout=0.5)
     assert result is None
     assert message_queue.queued_messages_count() == 2
+
+
+@pytest.mark.asyncio
+async def test_receive_with_key_predicate():
+    queue = MessageQueue(lambda: asyncio.sleep(0, None), key_fields=("id",))
+    messages = [Message("1", "First"), Message("2", "Second"), Message("1", "Third"), Message("3", "Fourth")]
+    for message in messages:
+        queue._push_back(message)
+
+    assert await queue.receive(KeyPredicate("id", "3", "2")) == messages[1]
+    assert await queue.receive(lambda m: m.content == "First") == messages[0]
+    assert await queue.receive(KeyPredicate("id", "1")) == messages[2]
+    assert await queue.receive(KeyPredicate("id", "3")) == messages[3]
+    assert queue.queued_messages_count() == 0
+    assert queue._stored_index == {}
+
+
+@pytest.mark.asyncio
+async def test_key_predicate_receives_error():
+    messages = [Message("2", "Second"), Message("error", "Failure"), Message("1", "First")]
+    queue = MessageQueueWithError(
+        lambda: asyncio.sleep(0, messages.pop(0) if messages else None),
+        KeyPredicate("id", "error"),
+        key_fields=("id",),
+    )
+    queue._push_back(Message("2", "Stored"))
+
+    result = await queue.receive(KeyPredicate("id", "1"))
+    assert result.id == "error"
+    assert await queue.receive(KeyPredicate("id", "2")) == result
+
+
+@pytest.mark.asyncio
+async def test_keyed_and_generic_receivers_keep_order():
+    messages = [Message("1", "First"), Message("1", "Second"), Message("2", "Third")]
+
+    async def receive_delegate():
+        await asyncio.sleep(0.01)
+        return messages.pop(0) if messages else None
+
+    queue = MessageQueue(receive_delegate)
+    generic = asyncio.create_task(queue.receive(lambda m: m.id == "1"))
+    await asyncio.sleep(0)
+    keyed = asyncio.create_task(queue.receive(KeyPredicate("id", "1", "2")))
+    await asyncio.sleep(0)
+    assert queue.waiting_receivers_count() == 2
+
+    assert [predicate for predicate, _ in queue.waiting_receivers][1] == KeyPredicate("id", "1", "2")
+
+    assert (await generic).content == "First"
+    assert (await keyed).content == "Second"
+    assert queue.waiting_receivers_count() == 0
+    assert queue.waiting_receivers == []
+    assert queue._keyed_receivers == {}
+
+
+@pytest.mark.asyncio
+async def test_cancelled_receiver_is_skipped():
+    messages = [Message("1", "First")]
+
+    async def receive_delegate():
+        await asyncio.sleep(0.05)
+        return messages.pop(0) if messages else None
+
+    queue = MessageQueue(receive_delegate)
+    cancelled = asyncio.create_task(queue.receive(KeyPredicate("id", "1")))
+    await asyncio.sleep(0)
+    waiting = asyncio.create_task(queue.receive(KeyPredicate("id", "1")))
+    await asyncio.sleep(0)
+    cancelled.cancel()
+
+    assert (await waiting).content == "First"
+
+
+@pytest.mark.asyncio
+async def test_polling_yields_during_bursts():
+    ticks = 0
+    remaining = 200
+
+    async def ticker():
+        nonlocal ticks
+        while True:
+            ticks += 1
+            await asyncio.sleep(0)
+
+    async def receive_delegate():
+        nonlocal remaining
+        remaining -= 1
+        return Message("last" if remaining == 0 else "burst", "")
+
+    queue = MessageQueue(receive_delegate)
+    ticker_task = asyncio.create_task(ticker())
+    await asyncio.sleep(0)
+    ticks_before = ticks
+
+    result = await queue.receive(lambda m: m.id == "last")
+    ticker_task.cancel()
+
+    assert result.id == "last"
+    assert ticks - ticks_before > 2
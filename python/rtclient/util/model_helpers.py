@@ -1,14 +1,30 @@
 # Copyright (c) Microsoft Corporation.
 # Licensed under the MIT license.
 
+from typing import Any, ClassVar
+
 from pydantic import BaseModel, model_validator
 
 
 class ModelWithDefaults(BaseModel):
+    _default_fields: ClassVar[tuple[tuple[str, Any], ...]] = ()
+
+    @classmethod
+    def __pydantic_init_subclass__(cls, **kwargs: Any) -> None:
+        super().__pydantic_init_subclass__(**kwargs)
+        # The fields and their defaults are fixed once the class is built, so collect them here
+        # instead of walking model_fields for every instance.
+        cls._default_fields = tuple(
+            (name, field.default) for name, field in cls.model_fields.items() if field.default is not None
+        )
+
     @model_validator(mode="after")
     def _add_defaults(self):
-        for field in self.model_fields:
-            if self.model_fields[field].default is not None:
-                if not hasattr(self, field) or getattr(self, field) == self.model_fields[field].default:
-                    setattr(self, field, self.model_fields[field].default)
+        fields_set = self.model_fields_set
+        for field, default in self._default_fields:
+            # Parsed server messages always carry their type, so most fields are already marked as set.
+            if field not in fields_set and getattr(self, field) == default:
+                # Mark the default as explicitly set without going through __setattr__,
+                # so this also works for frozen models.
+                fields_set.add(field)
         return self
@@ -4,6 +4,7 @@
 from typing import Optional
 
 from model_helpers import ModelWithDefaults
+from pydantic import ConfigDict
 
 
 class Bar(ModelWithDefaults):
@@ -12,6 +13,12 @@ class Bar(ModelWithDefaults):
     baz: int = 42
 
 
+class FrozenBar(ModelWithDefaults):
+    model_config = ConfigDict(frozen=True)
+
+    bar: Optional[float] = 3.14
+
+
 def test_with_defaults():
     instance = Bar()
     assert instance.foo is None
@@ -21,3 +28,8 @@ def test_with_defaults():
 def test_serialize_with_defaults():
     instance = Bar()
     assert instance.model_dump(exclude_unset=True) == {"bar": 3.14, "baz": 42}
+
+
+def test_serialize_frozen_with_defaults():
+    instance = FrozenBar()
+    assert instance.model_dump(exclude_unset=True) == {"bar": 3.14}
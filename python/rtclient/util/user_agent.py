@@ -2,9 +2,11 @@
 # Licensed under the MIT license.
 
 import platform
+from functools import cache
 from importlib.metadata import version
 
 
+@cache
 def get_user_agent():
     package_version = version("rtclient")
     python_version = platform.python_version()
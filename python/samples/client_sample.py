@@ -2,14 +2,22 @@
 # Licensed under the MIT license.
 
 import asyncio
+import itertools
+import math
 import os
 import sys
+from functools import cache
 
 import numpy as np
 import soundfile as sf
 from azure.core.credentials import AzureKeyCredential
 from dotenv import load_dotenv
-from scipy.signal import resample
+from scipy.signal import resample_poly
+
+try:
+    import soxr
+except ImportError:
+    soxr = None
 
 from rtclient import (
     InputAudioTranscription,
@@ -22,100 +30,144 @@ from rtclient import (
     ServerVAD,
 )
 
+SAMPLE_RATE = 24000
+CHUNK_DURATION_MS = 100
+CHUNKS_PER_READ = 10
+BYTES_PER_SAMPLE = 2
+MAX_CONCURRENT_ITEMS = 32
+
 
 def resample_audio(audio_data, original_sample_rate, target_sample_rate):
-    number_of_samples = round(len(audio_data) * float(target_sample_rate) / original_sample_rate)
-    resampled_audio = resample(audio_data, number_of_samples)
+    if soxr is not None:
+        return soxr.resample(audio_data, original_sample_rate, target_sample_rate, quality="HQ")
+    factor = math.gcd(original_sample_rate, target_sample_rate)
+    resampled_audio = resample_poly(audio_data, target_sample_rate // factor, original_sample_rate // factor)
     return resampled_audio.astype(np.int16)
 
 
-async def send_audio(client: RTClient, audio_file_path: str):
-    sample_rate = 24000
-    duration_ms = 100
-    samples_per_chunk = sample_rate * (duration_ms / 1000)
-    bytes_per_sample = 2
-    bytes_per_chunk = int(samples_per_chunk * bytes_per_sample)
-
-    extra_params = (
-        {
-            "samplerate": sample_rate,
-            "channels": 1,
-            "subtype": "PCM_16",
-        }
-        if audio_file_path.endswith(".raw")
-        else {}
-    )
-
-    audio_data, original_sample_rate = sf.read(audio_file_path, dtype="int16", **extra_params)
+def read_audio_chunks(audio_file_path: str, sample_rate: int, duration_ms: int):
+    if audio_file_path.endswith(".raw"):
+        # Raw files are expected to be mono PCM_16 at the target rate already.
+        bytes_per_chunk = sample_rate * duration_ms // 1000 * BYTES_PER_SAMPLE
+        with open(audio_file_path, "rb") as audio_file:
+            while chunk := audio_file.read(bytes_per_chunk):
+                yield chunk
+        return
+
+    with sf.SoundFile(audio_file_path) as audio_file:
+        original_sample_rate = audio_file.samplerate
+        if original_sample_rate != sample_rate and soxr is None:
+            # Without a streaming resampler the whole file is resampled at once.
+            samples_per_chunk = sample_rate * duration_ms // 1000
+            bytes_per_chunk = samples_per_chunk * BYTES_PER_SAMPLE
+            audio_data = resample_audio(audio_file.read(dtype="int16"), original_sample_rate, sample_rate)
+            audio_bytes = memoryview(np.ascontiguousarray(audio_data)).cast("B")
+            for i in range(0, len(audio_bytes), bytes_per_chunk):
+                yield audio_bytes[i : i + bytes_per_chunk]
+            return
+
+        resampler = None
+        if original_sample_rate != sample_rate:
+            resampler = soxr.ResampleStream(
+                original_sample_rate, sample_rate, audio_file.channels, dtype="int16", quality="HQ"
+            )
+        frames_left = audio_file.frames
+        for block in audio_file.blocks(blocksize=original_sample_rate * duration_ms // 1000, dtype="int16"):
+            if resampler is not None:
+                frames_left -= len(block)
+                block = resampler.resample_chunk(block, last=frames_left <= 0)
+            if len(block) > 0:
+                yield memoryview(block).cast("B")
 
-    if original_sample_rate != sample_rate:
-        audio_data = resample_audio(audio_data, original_sample_rate, sample_rate)
 
-    audio_bytes = audio_data.tobytes()
-
-    for i in range(0, len(audio_bytes), bytes_per_chunk):
-        chunk = audio_bytes[i : i + bytes_per_chunk]
-        await client.send_audio(chunk)
+async def send_audio(client: RTClient, audio_file_path: str):
+    # Keep a few chunks in flight while the next ones are read.
+    in_flight = asyncio.Semaphore(8)
+
+    async def send_chunk(chunk):
+        try:
+            await client.send_audio(chunk)
+        finally:
+            in_flight.release()
+
+    tasks = []
+    chunks = read_audio_chunks(audio_file_path, SAMPLE_RATE, CHUNK_DURATION_MS)
+    read = None
+    try:
+        while True:
+            read = asyncio.ensure_future(asyncio.to_thread(list, itertools.islice(chunks, CHUNKS_PER_READ)))
+            batch = await asyncio.shield(read)
+            if not batch:
+                break
+            for chunk in batch:
+                await in_flight.acquire()
+                tasks.append(asyncio.create_task(send_chunk(chunk)))
+        await asyncio.gather(*tasks)
+    finally:
+        # A cancelled read keeps running on its thread, so wait for it before closing.
+        if read is not None:
+            await asyncio.wait([read])
+        chunks.close()
+
+
+def write_text(path: str, text: str):
+    with open(path, "w", encoding="utf-8") as out:
+        out.write(text)
+
+
+def write_wav(path: str, audio_data: bytes):
+    with sf.SoundFile(path, mode="w", samplerate=SAMPLE_RATE, channels=1, format="WAV", subtype="PCM_16") as out:
+        out.buffer_write(audio_data, dtype="int16")
 
 
 async def receive_message_item(item: RTMessageItem, out_dir: str):
     prefix = f"[response={item.response_id}][item={item.id}]"
     async for contentPart in item:
+        base_path = os.path.join(out_dir, f"{item.id}_{contentPart.content_index}")
         if contentPart.type == "audio":
 
             async def collect_audio(audioContentPart: RTAudioContent):
-                audio_data = bytearray()
-                async for chunk in audioContentPart.audio_chunks():
-                    audio_data.extend(chunk)
-                return audio_data
+                return b"".join([chunk async for chunk in audioContentPart.audio_chunks()])
 
             async def collect_transcript(audioContentPart: RTAudioContent):
-                audio_transcript: str = ""
-                async for chunk in audioContentPart.transcript_chunks():
-                    audio_transcript += chunk
-                return audio_transcript
+                return "".join([chunk async for chunk in audioContentPart.transcript_chunks()])
 
             audio_task = asyncio.create_task(collect_audio(contentPart))
             transcript_task = asyncio.create_task(collect_transcript(contentPart))
             audio_data, audio_transcript = await asyncio.gather(audio_task, transcript_task)
             print(prefix, f"Audio received with length: {len(audio_data)}")
             print(prefix, f"Audio Transcript: {audio_transcript}")
-            with open(os.path.join(out_dir, f"{item.id}_{contentPart.content_index}.wav"), "wb") as out:
-                audio_array = np.frombuffer(audio_data, dtype=np.int16)
-                sf.write(out, audio_array, samplerate=24000)
-            with open(
-                os.path.join(out_dir, f"{item.id}_{contentPart.content_index}.audio_transcript.txt"),
-                "w",
-                encoding="utf-8",
-            ) as out:
-                out.write(audio_transcript)
+            await asyncio.to_thread(write_wav, f"{base_path}.wav", audio_data)
+            await asyncio.to_thread(write_text, f"{base_path}.audio_transcript.txt", audio_transcript)
         elif contentPart.type == "text":
-            text_data = ""
-            async for chunk in contentPart.text_chunks():
-                text_data += chunk
+            text_data = "".join([chunk async for chunk in contentPart.text_chunks()])
             print(prefix, f"Text: {text_data}")
-            with open(
-                os.path.join(out_dir, f"{item.id}_{contentPart.content_index}.text.txt"), "w", encoding="utf-8"
-            ) as out:
-                out.write(text_data)
+            await asyncio.to_thread(write_text, f"{base_path}.text.txt", text_data)
 
 
 async def receive_function_call_item(item: RTFunctionCallItem, out_dir: str):
     prefix = f"[function_call_item={item.id}]"
     await item
     print(prefix, f"Function call arguments: {item.arguments}")
-    with open(os.path.join(out_dir, f"{item.id}.function_call.json"), "w", encoding="utf-8") as out:
-        out.write(item.arguments)
+    await asyncio.to_thread(write_text, os.path.join(out_dir, f"{item.id}.function_call.json"), item.arguments)
+
+
+async def run_bounded(limit: asyncio.Semaphore, coroutine):
+    async with limit:
+        await coroutine
 
 
 async def receive_response(client: RTClient, response: RTResponse, out_dir: str):
     prefix = f"[response={response.id}]"
+    limit = asyncio.Semaphore(MAX_CONCURRENT_ITEMS)
+    tasks = []
     async for item in response:
         print(prefix, f"Received item {item.id}")
         if item.type == "message":
-            asyncio.create_task(receive_message_item(item, out_dir))
+            tasks.append(asyncio.create_task(run_bounded(limit, receive_message_item(item, out_dir))))
         elif item.type == "function_call":
-            asyncio.create_task(receive_function_call_item(item, out_dir))
+            tasks.append(asyncio.create_task(run_bounded(limit, receive_function_call_item(item, out_dir))))
+    await asyncio.gather(*tasks)
 
     print(prefix, f"Response completed ({response.status})")
     if response.status == "completed":
@@ -131,11 +183,14 @@ async def receive_input_item(item: RTInputAudioItem):
 
 
 async def receive_events(client: RTClient, out_dir: str):
+    limit = asyncio.Semaphore(MAX_CONCURRENT_ITEMS)
+    tasks = []
     async for event in client.events():
         if event.type == "input_audio":
-            asyncio.create_task(receive_input_item(event))
+            tasks.append(asyncio.create_task(run_bounded(limit, receive_input_item(event))))
         elif event.type == "response":
-            asyncio.create_task(receive_response(client, event, out_dir))
+            tasks.append(asyncio.create_task(run_bounded(limit, receive_response(client, event, out_dir))))
+    await asyncio.gather(*tasks)
 
 
 async def receive_messages(client: RTClient, out_dir: str):
@@ -155,6 +210,7 @@ async def run(client: RTClient, audio_file_path: str, out_dir: str):
     await asyncio.gather(send_audio(client, audio_file_path), receive_messages(client, out_dir))
 
 
+@cache
 def get_env_var(var_name: str) -> str:
     value = os.environ.get(var_name)
     if not value:
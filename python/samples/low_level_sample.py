@@ -3,14 +3,22 @@
 
 import asyncio
 import base64
+import itertools
+import math
 import os
 import sys
+from functools import cache
 
 import numpy as np
 import soundfile as sf
 from azure.core.credentials import AzureKeyCredential
 from dotenv import load_dotenv
-from scipy.signal import resample
+from scipy.signal import resample_poly
+
+try:
+    import soxr
+except ImportError:
+    soxr = None
 
 from rtclient import (
     InputAudioBufferAppendMessage,
@@ -21,41 +29,84 @@ from rtclient import (
     SessionUpdateParams,
 )
 
+SAMPLE_RATE = 24000
+CHUNK_DURATION_MS = 100
+CHUNKS_PER_READ = 10
+BYTES_PER_SAMPLE = 2
+
 
 def resample_audio(audio_data, original_sample_rate, target_sample_rate):
-    number_of_samples = round(len(audio_data) * float(target_sample_rate) / original_sample_rate)
-    resampled_audio = resample(audio_data, number_of_samples)
+    if soxr is not None:
+        return soxr.resample(audio_data, original_sample_rate, target_sample_rate, quality="HQ")
+    factor = math.gcd(original_sample_rate, target_sample_rate)
+    resampled_audio = resample_poly(audio_data, target_sample_rate // factor, original_sample_rate // factor)
     return resampled_audio.astype(np.int16)
 
 
-async def send_audio(client: RTLowLevelClient, audio_file_path: str):
-    sample_rate = 24000
-    duration_ms = 100
-    samples_per_chunk = sample_rate * (duration_ms / 1000)
-    bytes_per_sample = 2
-    bytes_per_chunk = int(samples_per_chunk * bytes_per_sample)
+def read_audio_chunks(audio_file_path: str, sample_rate: int, duration_ms: int):
+    if audio_file_path.endswith(".raw"):
+        # Raw files are expected to be mono PCM_16 at the target rate already.
+        bytes_per_chunk = sample_rate * duration_ms // 1000 * BYTES_PER_SAMPLE
+        with open(audio_file_path, "rb") as audio_file:
+            while chunk := audio_file.read(bytes_per_chunk):
+                yield chunk
+        return
 
-    extra_params = (
-        {
-            "samplerate": sample_rate,
-            "channels": 1,
-            "subtype": "PCM_16",
-        }
-        if audio_file_path.endswith(".raw")
-        else {}
-    )
+    with sf.SoundFile(audio_file_path) as audio_file:
+        original_sample_rate = audio_file.samplerate
+        if original_sample_rate != sample_rate and soxr is None:
+            # Without a streaming resampler the whole file is resampled at once.
+            samples_per_chunk = sample_rate * duration_ms // 1000
+            bytes_per_chunk = samples_per_chunk * BYTES_PER_SAMPLE
+            audio_data = resample_audio(audio_file.read(dtype="int16"), original_sample_rate, sample_rate)
+            audio_bytes = memoryview(np.ascontiguousarray(audio_data)).cast("B")
+            for i in range(0, len(audio_bytes), bytes_per_chunk):
+                yield audio_bytes[i : i + bytes_per_chunk]
+            return
 
-    audio_data, original_sample_rate = sf.read(audio_file_path, dtype="int16", **extra_params)
+        resampler = None
+        if original_sample_rate != sample_rate:
+            resampler = soxr.ResampleStream(
+                original_sample_rate, sample_rate, audio_file.channels, dtype="int16", quality="HQ"
+            )
+        frames_left = audio_file.frames
+        for block in audio_file.blocks(blocksize=original_sample_rate * duration_ms // 1000, dtype="int16"):
+            if resampler is not None:
+                frames_left -= len(block)
+                block = resampler.resample_chunk(block, last=frames_left <= 0)
+            if len(block) > 0:
+                yield memoryview(block).cast("B")
 
-    if original_sample_rate != sample_rate:
-        audio_data = resample_audio(audio_data, original_sample_rate, sample_rate)
 
-    audio_bytes = audio_data.tobytes()
+async def send_audio(client: RTLowLevelClient, audio_file_path: str):
+    # Keep a few chunks in flight while the next ones are read.
+    in_flight = asyncio.Semaphore(8)
+
+    async def send_chunk(chunk):
+        try:
+            base64_audio = base64.b64encode(chunk).decode("utf-8")
+            await client.send(InputAudioBufferAppendMessage(audio=base64_audio))
+        finally:
+            in_flight.release()
 
-    for i in range(0, len(audio_bytes), bytes_per_chunk):
-        chunk = audio_bytes[i : i + bytes_per_chunk]
-        base64_audio = base64.b64encode(chunk).decode("utf-8")
-        await client.send(InputAudioBufferAppendMessage(audio=base64_audio))
+    tasks = []
+    chunks = read_audio_chunks(audio_file_path, SAMPLE_RATE, CHUNK_DURATION_MS)
+    read = None
+    try:
+        while True:
+            read = asyncio.ensure_future(asyncio.to_thread(list, itertools.islice(chunks, CHUNKS_PER_READ)))
+            batch = await asyncio.shield(read)
+            if not batch:
+                break
+            for chunk in batch:
+                await in_flight.acquire()
+                tasks.append(asyncio.create_task(send_chunk(chunk)))
+        await asyncio.gather(*tasks)
+    finally:
+        # A cancelled read keeps running on its thread, so wait for it before closing.
+        if read is not None:
+            await asyncio.wait([read])
+        chunks.close()
 
 
 async def receive_messages(client: RTLowLevelClient):
@@ -222,6 +273,7 @@ async def receive_messages(client: RTLowLevelClient):
                 print("Unknown Message")
 
 
+@cache
 def get_env_var(var_name: str) -> str:
     value = os.environ.get(var_name)
     if not value:
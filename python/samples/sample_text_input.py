@@ -5,8 +5,8 @@ import asyncio
 import os
 import sys
 import time
+from functools import cache
 
-import numpy as np
 import soundfile as sf
 from azure.core.credentials import AzureKeyCredential
 from dotenv import load_dotenv
@@ -21,72 +21,75 @@ from rtclient import (
     UserMessageItem,
 )
 
-start_time = time.time()
+# Monotonic, so log timestamps don't jump when the wall clock is adjusted.
+start_time = time.monotonic_ns()
+SAMPLE_RATE = 24000
+MAX_CONCURRENT_ITEMS = 32
 
 
 def log(*args):
-    elapsed_time_ms = int((time.time() - start_time) * 1000)
+    elapsed_time_ms = (time.monotonic_ns() - start_time) // 1_000_000
     print(f"{elapsed_time_ms} [ms]: ", *args)
 
 
+def write_text(path: str, text: str):
+    with open(path, "w", encoding="utf-8") as out:
+        out.write(text)
+
+
+def write_wav(path: str, audio_data: bytes):
+    with sf.SoundFile(path, mode="w", samplerate=SAMPLE_RATE, channels=1, format="WAV", subtype="PCM_16") as out:
+        out.buffer_write(audio_data, dtype="int16")
+
+
 async def receive_message_item(item: RTMessageItem, out_dir: str):
     prefix = f"[response={item.response_id}][item={item.id}]"
     async for contentPart in item:
+        base_path = os.path.join(out_dir, f"{item.id}_{contentPart.content_index}")
         if contentPart.type == "audio":
 
             async def collect_audio(audioContentPart: RTAudioContent):
-                audio_data = bytearray()
-                async for chunk in audioContentPart.audio_chunks():
-                    audio_data.extend(chunk)
-                return audio_data
+                return b"".join([chunk async for chunk in audioContentPart.audio_chunks()])
 
             async def collect_transcript(audioContentPart: RTAudioContent):
-                audio_transcript: str = ""
-                async for chunk in audioContentPart.transcript_chunks():
-                    audio_transcript += chunk
-                return audio_transcript
+                return "".join([chunk async for chunk in audioContentPart.transcript_chunks()])
 
             audio_task = asyncio.create_task(collect_audio(contentPart))
             transcript_task = asyncio.create_task(collect_transcript(contentPart))
             audio_data, audio_transcript = await asyncio.gather(audio_task, transcript_task)
             print(prefix, f"Audio received with length: {len(audio_data)}")
             print(prefix, f"Audio Transcript: {audio_transcript}")
-            with open(os.path.join(out_dir, f"{item.id}_{contentPart.content_index}.wav"), "wb") as out:
-                audio_array = np.frombuffer(audio_data, dtype=np.int16)
-                sf.write(out, audio_array, samplerate=24000)
-            with open(
-                os.path.join(out_dir, f"{item.id}_{contentPart.content_index}.audio_transcript.txt"),
-                "w",
-                encoding="utf-8",
-            ) as out:
-                out.write(audio_transcript)
+            await asyncio.to_thread(write_wav, f"{base_path}.wav", audio_data)
+            await asyncio.to_thread(write_text, f"{base_path}.audio_transcript.txt", audio_transcript)
         elif contentPart.type == "text":
-            text_data = ""
-            async for chunk in contentPart.text_chunks():
-                text_data += chunk
+            text_data = "".join([chunk async for chunk in contentPart.text_chunks()])
             print(prefix, f"Text: {text_data}")
-            with open(
-                os.path.join(out_dir, f"{item.id}_{contentPart.content_index}.text.txt"), "w", encoding="utf-8"
-            ) as out:
-                out.write(text_data)
+            await asyncio.to_thread(write_text, f"{base_path}.text.txt", text_data)
 
 
 async def receive_function_call_item(item: RTFunctionCallItem, out_dir: str):
     prefix = f"[function_call_item={item.id}]"
     await item
     print(prefix, f"Function call arguments: {item.arguments}")
-    with open(os.path.join(out_dir, f"{item.id}.function_call.json"), "w", encoding="utf-8") as out:
-        out.write(item.arguments)
+    await asyncio.to_thread(write_text, os.path.join(out_dir, f"{item.id}.function_call.json"), item.arguments)
+
+
+async def run_bounded(limit: asyncio.Semaphore, coroutine):
+    async with limit:
+        await coroutine
 
 
 async def receive_response(client: RTClient, response: RTResponse, out_dir: str):
     prefix = f"[response={response.id}]"
+    limit = asyncio.Semaphore(MAX_CONCURRENT_ITEMS)
+    tasks = []
     async for item in response:
         print(prefix, f"Received item {item.id}")
         if item.type == "message":
-            asyncio.create_task(receive_message_item(item, out_dir))
+            tasks.append(asyncio.create_task(run_bounded(limit, receive_message_item(item, out_dir))))
         elif item.type == "function_call":
-            asyncio.create_task(receive_function_call_item(item, out_dir))
+            tasks.append(asyncio.create_task(run_bounded(limit, receive_function_call_item(item, out_dir))))
+    await asyncio.gather(*tasks)
 
     print(prefix, f"Response completed ({response.status})")
     if response.status == "completed":
@@ -112,6 +115,7 @@ async def run(client: RTClient, instructions_file_path: str, user_message_file_p
         await receive_response(client, response, out_dir)
 
 
+@cache
 def get_env_var(var_name: str) -> str:
     value = os.environ.get(var_name)
     if not value:
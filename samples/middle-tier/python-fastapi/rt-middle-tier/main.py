@@ -3,14 +3,18 @@ from fastapi.middleware.cors import CORSMiddleware
 from fastapi.websockets import WebSocketState
 import uvicorn
 import uuid
-import json
+import time
+from contextlib import asynccontextmanager
+from functools import cache
+import orjson
 from typing import Union, Literal, TypedDict
 import asyncio
 from loguru import logger
 import os
 from dotenv import load_dotenv
-from azure.identity import DefaultAzureCredential
-from azure.core.credentials import AzureKeyCredential
+from azure.identity.aio import DefaultAzureCredential
+from azure.core.credentials import AccessToken, AzureKeyCredential
+from azure.core.credentials_async import AsyncTokenCredential
 from rtclient import (
     InputAudioTranscription,
     RTClient,
@@ -22,6 +26,14 @@ from rtclient import (
 
 load_dotenv()
 
+# Settings don't change while the server runs, so they are read once at startup.
+BACKEND = os.getenv("BACKEND")
+AZURE_OPENAI_ENDPOINT = os.getenv("AZURE_OPENAI_ENDPOINT")
+AZURE_OPENAI_DEPLOYMENT = os.getenv("AZURE_OPENAI_DEPLOYMENT")
+OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
+OPENAI_MODEL = os.getenv("OPENAI_MODEL")
+MAX_SESSIONS = int(os.getenv("MAX_SESSIONS", "256"))
+
 
 class TextDelta(TypedDict):
     id: str
@@ -50,6 +62,122 @@ class ControlMessage(TypedDict):
 
 WSMessage = Union[TextDelta, Transcription, UserMessage, ControlMessage]
 
+# Control messages with a fixed shape are encoded once at import time;
+# text_done only needs its id spliced in.
+CONNECTED_MESSAGE = orjson.dumps(
+    {
+        "type": "control",
+        "action": "connected",
+        "greeting": "You are now connected to the FastAPI server",
+    }
+).decode()
+SPEECH_STARTED_MESSAGE = orjson.dumps(
+    {"type": "control", "action": "speech_started"}
+).decode()
+TEXT_DONE_PREFIX = '{"type":"control","action":"text_done","id":'
+
+DELTA_BATCH_INTERVAL = 0.015
+MAX_BATCHED_DELTAS = 64
+AUDIO_QUEUE_SIZE = 32
+MAX_AUDIO_FRAME_BYTES = 64 * 1024
+TOKEN_REFRESH_MARGIN_SECONDS = 60
+
+
+class CachedTokenCredential:
+    """
+    Hands the same token to every session and only asks the wrapped credential for a
+    new one when it is about to expire.
+    """
+
+    def __init__(self, credential: AsyncTokenCredential):
+        self._credential = credential
+        self._tokens: dict[tuple[str, ...], AccessToken] = {}
+        self._lock = asyncio.Lock()
+
+    async def get_token(self, *scopes: str, **kwargs) -> AccessToken:
+        if kwargs:
+            # Tokens requested with claims or a tenant are specific to that request.
+            return await self._credential.get_token(*scopes, **kwargs)
+        async with self._lock:
+            token = self._tokens.get(scopes)
+            if (
+                token is None
+                or token.expires_on - time.time() < TOKEN_REFRESH_MARGIN_SECONDS
+            ):
+                token = await self._credential.get_token(*scopes, **kwargs)
+                self._tokens[scopes] = token
+            return token
+
+    async def close(self):
+        await self._credential.close()
+
+
+@cache
+def get_credential() -> CachedTokenCredential:
+    # Building DefaultAzureCredential probes the whole provider chain, so it is done
+    # once for the process rather than for every session.
+    return CachedTokenCredential(DefaultAzureCredential())
+
+
+class TextDeltaBatcher:
+    """
+    Coalesces the text deltas of one content part into fewer text_delta messages.
+    Deltas received within DELTA_BATCH_INTERVAL are concatenated and sent as a single
+    delta, which clients append like any other, so the protocol is unchanged.
+    """
+
+    def __init__(self, session: "RTSession", content_id: str):
+        self._session = session
+        # Reused for every batch; send encodes it before the next batch can change it.
+        self._message: TextDelta = {"id": content_id, "type": "text_delta", "delta": ""}
+        self._pending: list[str] = []
+        # Held while a batch is being sent, so flush() can tell whether the timer task
+        # is still sleeping and can be cancelled.
+        self._lock = asyncio.Lock()
+        self._flush_task: asyncio.Task | None = None
+
+    async def add(self, text: str):
+        self._pending.append(text)
+        if len(self._pending) >= MAX_BATCHED_DELTAS:
+            # Waiting for the send here keeps a slow client from piling up deltas.
+            await self.flush()
+        elif self._flush_task is None or self._flush_task.done():
+            if self._flush_task is not None:
+                # Surfaces a send that failed on the timer task.
+                self._flush_task.result()
+            self._flush_task = asyncio.create_task(self._flush_later())
+
+    async def _flush_later(self):
+        await asyncio.sleep(DELTA_BATCH_INTERVAL)
+        await self._send_pending()
+
+    async def flush(self):
+        """Sends the pending deltas now and stops the timer."""
+        task, self._flush_task = self._flush_task, None
+        if task is not None:
+            if not self._lock.locked():
+                # The timer hasn't fired yet; its batch goes out below instead.
+                task.cancel()
+            (result,) = await asyncio.gather(task, return_exceptions=True)
+            if isinstance(result, Exception):
+                raise result
+        await self._send_pending()
+
+    async def aclose(self):
+        """Stops the timer without sending, for when the stream ends early."""
+        task, self._flush_task = self._flush_task, None
+        if task is not None:
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+
+    async def _send_pending(self):
+        async with self._lock:
+            if not self._pending:
+                return
+            self._message["delta"] = "".join(self._pending)
+            self._pending.clear()
+            await self._session.send(self._message)
+
 
 class RTSession:
     def __init__(self, websocket: WebSocket, backend: str | None):
@@ -57,6 +185,8 @@ class RTSession:
         self.websocket = websocket
         self.logger = logger.bind(session_id=self.session_id)
         self.client = self._initialize_client(backend)
+        # Handlers for client text messages, keyed by message type.
+        self._text_handlers = {"user_message": self.handle_user_message}
         self.logger.info("New session created")
 
     async def __aenter__(self):
@@ -68,25 +198,32 @@ class RTSession:
         self.logger.info("Session closed")
 
     def _initialize_client(self, backend: str | None):
-        self.logger.debug(f"Initializing RT client with backend: {backend}")
+        self.logger.debug("Initializing RT client with backend: {}", backend)
 
         if backend == "azure":
             return RTClient(
-                url=os.getenv("AZURE_OPENAI_ENDPOINT"),
-                token_credential=DefaultAzureCredential(),
-                deployment=os.getenv("AZURE_OPENAI_DEPLOYMENT"),
+                url=AZURE_OPENAI_ENDPOINT,
+                token_credential=get_credential(),
+                deployment=AZURE_OPENAI_DEPLOYMENT,
             )
         return RTClient(
-            key_credential=AzureKeyCredential(os.getenv("OPENAI_API_KEY")),
-            model=os.getenv("OPENAI_MODEL"),
+            key_credential=AzureKeyCredential(OPENAI_API_KEY),
+            model=OPENAI_MODEL,
         )
 
     async def send(self, message: WSMessage):
-        await self.websocket.send_json(message)
+        # The protocol is shared with the other middle tiers and the generic frontend,
+        # so messages stay JSON text frames; orjson just encodes them faster.
+        await self.websocket.send_text(orjson.dumps(message).decode())
 
     async def send_binary(self, message: bytes):
         await self.websocket.send_bytes(message)
 
+    async def send_text_done(self, content_id: str):
+        await self.websocket.send_text(
+            TEXT_DONE_PREFIX + orjson.dumps(content_id).decode() + "}"
+        )
+
     async def initialize(self):
         self.logger.debug("Configuring realtime session")
         await self.client.configure(
@@ -97,14 +234,41 @@ class RTSession:
             turn_detection=ServerVAD(),
         )
 
-        greeting: ControlMessage = {
-            "type": "control",
-            "action": "connected",
-            "greeting": "You are now connected to the FastAPI server",
-        }
-        await self.send(greeting)
+        await self.websocket.send_text(CONNECTED_MESSAGE)
         self.logger.debug("Realtime session configured successfully")
-        asyncio.create_task(self.start_event_loop())
+
+    async def run(self):
+        """
+        Relays messages until the client disconnects or the upstream session ends.
+        Whichever side stops first cancels the other, so failures close the session.
+        """
+        tasks = [
+            asyncio.create_task(self.start_event_loop()),
+            asyncio.create_task(self.receive_client_messages()),
+        ]
+        try:
+            done, _ = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+        for task in done:
+            task.result()
+
+    async def receive_client_messages(self):
+        # Frames arrive at microphone rate, so the bound methods are looked up once.
+        receive = self.websocket.receive
+        handle_binary_message = self.handle_binary_message
+        handle_text_message = self.handle_text_message
+        while True:
+            message = await receive()
+            # The ASGI spec allows the unused payload key to be present as None.
+            if (data := message.get("bytes")) is not None:
+                await handle_binary_message(data)
+            elif (text := message.get("text")) is not None:
+                await handle_text_message(text)
+            elif message["type"] == "websocket.disconnect":
+                break
 
     async def handle_binary_message(self, message: bytes):
         try:
@@ -115,37 +279,40 @@ class RTSession:
 
     async def handle_text_message(self, message: str):
         try:
-            parsed: WSMessage = json.loads(message)
-            self.logger.debug(f"Received text message type: {parsed['type']}")
-
-            if parsed["type"] == "user_message":
-                await self.client.send_item(
-                    {
-                        "type": "message",
-                        "role": "user",
-                        "content": [{"type": "input_text", "text": parsed["text"]}],
-                    }
-                )
-                await self.client.generate_response()
-                self.logger.debug("User message processed successfully")
+            parsed: WSMessage = orjson.loads(message)
+            # Arguments are only formatted when a sink accepts debug records.
+            self.logger.debug("Received text message type: {}", parsed["type"])
+
+            handler = self._text_handlers.get(parsed["type"])
+            if handler is not None:
+                await handler(parsed)
         except Exception as error:
             self.logger.error(f"Failed to process user message: {error}")
             raise
 
+    async def handle_user_message(self, message: UserMessage):
+        await self.client.send_item(
+            {
+                "type": "message",
+                "role": "user",
+                "content": [{"type": "input_text", "text": message["text"]}],
+            }
+        )
+        await self.client.generate_response()
+        self.logger.debug("User message processed successfully")
+
     async def handle_text_content(self, content):
         try:
             content_id = f"{content.item_id}-{content.content_index}"
-            async for text in content.text_chunks():
-                delta_message: TextDelta = {
-                    "id": content_id,
-                    "type": "text_delta",
-                    "delta": text,
-                }
-                await self.send(delta_message)
-
-            await self.send(
-                {"type": "control", "action": "text_done", "id": content_id}
-            )
+            batcher = TextDeltaBatcher(self, content_id)
+            try:
+                async for text in content.text_chunks():
+                    await batcher.add(text)
+                await batcher.flush()
+            finally:
+                await batcher.aclose()
+
+            await self.send_text_done(content_id)
             self.logger.debug("Text content processed successfully")
         except Exception as error:
             self.logger.error(f"Error handling text content: {error}")
@@ -153,18 +320,68 @@ class RTSession:
 
     async def handle_audio_content(self, content: RTAudioContent):
         async def handle_audio_chunks():
-            async for chunk in content.audio_chunks():
-                await self.send_binary(chunk)
+            # Reading the next chunk from the service overlaps with sending the previous
+            # one to the client, and the bounded queue holds reading back if sends lag.
+            queue: asyncio.Queue[bytes | None] = asyncio.Queue(maxsize=AUDIO_QUEUE_SIZE)
+
+            async def send_chunks():
+                finished = False
+                while not finished and (chunk := await queue.get()) is not None:
+                    # Chunks that queued up while the previous frame was being written
+                    # are sent together, so a lagging client gets fewer, larger frames.
+                    chunks = [chunk]
+                    size = len(chunk)
+                    while size < MAX_AUDIO_FRAME_BYTES and not queue.empty():
+                        chunk = queue.get_nowait()
+                        if chunk is None:
+                            finished = True
+                            break
+                        chunks.append(chunk)
+                        size += len(chunk)
+                    await self.send_binary(
+                        chunks[0] if len(chunks) == 1 else b"".join(chunks)
+                    )
+
+            async def put(chunk: bytes | None):
+                if not sender.done() and queue.full():
+                    putter = asyncio.ensure_future(queue.put(chunk))
+                    try:
+                        await asyncio.wait(
+                            (putter, sender), return_when=asyncio.FIRST_COMPLETED
+                        )
+                    except asyncio.CancelledError:
+                        putter.cancel()
+                        raise
+                    if putter.done():
+                        return
+                    putter.cancel()
+                if sender.done():
+                    # Stop reading from the service as soon as a send to the client failed.
+                    sender.result()
+                queue.put_nowait(chunk)
+
+            sender = asyncio.create_task(send_chunks())
+            try:
+                async for chunk in content.audio_chunks():
+                    await put(chunk)
+                await put(None)
+                await sender
+            finally:
+                # Reached on cancellation and errors too, so the sender never outlives
+                # the content part and keeps writing to a closed socket.
+                sender.cancel()
+                await asyncio.gather(sender, return_exceptions=True)
 
         async def handle_audio_transcript():
             content_id = f"{content.item_id}-{content.content_index}"
-            async for chunk in content.transcript_chunks():
-                await self.send(
-                    {"id": content_id, "type": "text_delta", "delta": chunk}
-                )
-            await self.send(
-                {"type": "control", "action": "text_done", "id": content_id}
-            )
+            batcher = TextDeltaBatcher(self, content_id)
+            try:
+                async for chunk in content.transcript_chunks():
+                    await batcher.add(chunk)
+                await batcher.flush()
+            finally:
+                await batcher.aclose()
+            await self.send_text_done(content_id)
 
         try:
             await asyncio.gather(handle_audio_chunks(), handle_audio_transcript())
@@ -189,7 +406,7 @@ class RTSession:
 
     async def handle_input_audio(self, event: RTInputAudioItem):
         try:
-            await self.send({"type": "control", "action": "speech_started"})
+            await self.websocket.send_text(SPEECH_STARTED_MESSAGE)
             await event
 
             transcription: Transcription = {
@@ -199,7 +416,8 @@ class RTSession:
             }
             await self.send(transcription)
             self.logger.debug(
-                f"Input audio processed successfully, transcription length: {len(transcription['text'])}"
+                "Input audio processed successfully, transcription length: {}",
+                len(transcription["text"]),
             )
         except Exception as error:
             self.logger.error(f"Error handling input audio: {error}")
@@ -218,7 +436,15 @@ class RTSession:
             raise
 
 
-app = FastAPI()
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    yield
+    # The credential owns an HTTP session, so it is closed when the worker shuts down.
+    if get_credential.cache_info().currsize:
+        await get_credential().close()
+
+
+app = FastAPI(lifespan=lifespan)
 
 # Add CORS middleware
 app.add_middleware(
@@ -230,21 +456,30 @@ app.add_middleware(
 )
 
 
+# Each session holds an upstream realtime connection, so their number is capped.
+session_slots = asyncio.Semaphore(MAX_SESSIONS)
+
+
 @app.websocket("/realtime")
 async def websocket_endpoint(websocket: WebSocket):
     await websocket.accept()
+    if session_slots.locked():
+        # 1013 (Try Again Later) tells the client the refusal is temporary.
+        logger.warning("Session limit reached, rejecting WebSocket connection")
+        await websocket.close(code=1013, reason="Server busy")
+        return
+
+    async with session_slots:
+        await run_session(websocket)
+
+
+async def run_session(websocket: WebSocket):
     logger.info("New WebSocket connection established")
 
-    async with RTSession(websocket, os.getenv("BACKEND")) as session:
+    async with RTSession(websocket, BACKEND) as session:
         try:
             await session.initialize()
-
-            while websocket.client_state != WebSocketState.DISCONNECTED:
-                message = await websocket.receive()
-                if "bytes" in message:
-                    await session.handle_binary_message(message["bytes"])
-                elif "text" in message:
-                    await session.handle_text_message(message["text"])
+            await session.run()
         except Exception as e:
             logger.error(f"WebSocket error: {e}")
         finally:
@@ -255,4 +490,9 @@ async def websocket_endpoint(websocket: WebSocket):
 
 if __name__ == "__main__":
     port = int(os.getenv("PORT", "8080"))
-    uvicorn.run(app, host="0.0.0.0", port=port, log_level="info")
+    # A WebSocket session lives in one worker process, so workers share no state.
+    workers = int(os.getenv("WEB_CONCURRENCY", "1"))
+    # Starting more than one worker needs the app as an import string.
+    uvicorn.run(
+        "main:app", host="0.0.0.0", port=port, workers=workers, log_level="info"
+    )